@@ -143,6 +143,121 @@ app.post('/mcp', (req, res) => {
     res.json(response);
 });
 
+// Калькулятор: выражение один раз разбирается в дерево замыканий,
+// повторные вызовы берут готовую функцию из кэша (без eval)
+const CALC_CACHE_MAX = 256;
+const calcCache = new Map();
+
+const BINARY_OPS = {
+    '+': (a, b) => a + b,
+    '-': (a, b) => a - b,
+    '*': (a, b) => a * b,
+    '/': (a, b) => a / b,
+    '%': (a, b) => a % b,
+    '**': (a, b) => a ** b
+};
+
+function tokenizeExpression(expr) {
+    const tokens = [];
+    const re = /\s*(?:(\d+(?:\.\d*)?|\.\d+)|(\*\*|[-+*/%()]))/y;
+    let match;
+    while (re.lastIndex < expr.length) {
+        const start = re.lastIndex;
+        if (!(match = re.exec(expr))) {
+            if (expr.slice(start).trim() === '') break;
+            throw new Error(`Недопустимый символ: ${expr.slice(start).trim()[0]}`);
+        }
+        tokens.push(match[1] !== undefined ? { num: parseFloat(match[1]) } : { op: match[2] });
+    }
+    return tokens;
+}
+
+function compileExpression(expr) {
+    const tokens = tokenizeExpression(expr);
+    let pos = 0;
+
+    const peek = () => tokens[pos]?.op;
+
+    // sum := product (('+' | '-') product)*
+    function parseSum() {
+        let node = parseProduct();
+        while (peek() === '+' || peek() === '-') {
+            node = binary(tokens[pos++].op, node, parseProduct());
+        }
+        return node;
+    }
+
+    // product := unary (('*' | '/' | '%') unary)*
+    function parseProduct() {
+        let node = parseUnary();
+        while (peek() === '*' || peek() === '/' || peek() === '%') {
+            node = binary(tokens[pos++].op, node, parseUnary());
+        }
+        return node;
+    }
+
+    // unary := ('-' | '+') unary | power
+    function parseUnary() {
+        if (peek() === '-') {
+            pos++;
+            const operand = parseUnary();
+            return () => -operand();
+        }
+        if (peek() === '+') {
+            pos++;
+            return parseUnary();
+        }
+        return parsePower();
+    }
+
+    // power := primary ('**' unary)?  (правоассоциативно)
+    function parsePower() {
+        const base = parsePrimary();
+        if (peek() === '**') {
+            pos++;
+            return binary('**', base, parseUnary());
+        }
+        return base;
+    }
+
+    // primary := число | '(' sum ')'
+    function parsePrimary() {
+        const token = tokens[pos++];
+        if (token === undefined) throw new Error('Неожиданный конец выражения');
+        if (token.num !== undefined) {
+            const value = token.num;
+            return () => value;
+        }
+        if (token.op === '(') {
+            const node = parseSum();
+            if (tokens[pos++]?.op !== ')') throw new Error('Ожидалась )');
+            return node;
+        }
+        throw new Error(`Неожиданный оператор: ${token.op}`);
+    }
+
+    function binary(op, left, right) {
+        const fn = BINARY_OPS[op];
+        return () => fn(left(), right());
+    }
+
+    const root = parseSum();
+    if (pos < tokens.length) throw new Error(`Лишний токен: ${tokens[pos].op ?? tokens[pos].num}`);
+    return root;
+}
+
+function evaluateExpression(expr) {
+    let fn = calcCache.get(expr);
+    if (fn === undefined) {
+        fn = compileExpression(expr);
+        if (calcCache.size >= CALC_CACHE_MAX) {
+            calcCache.delete(calcCache.keys().next().value);
+        }
+        calcCache.set(expr, fn);
+    }
+    return fn();
+}
+
 // Обработка вызовов инструментов
 function handleToolCall(params) {
     const { name, arguments: args } = params;
@@ -175,8 +290,7 @@ function handleToolCall(params) {
             try {
                 const expr = args?.expression || '0';
                 // Безопасное вычисление (только числа и операторы)
-                const safeExpr = expr.replace(/[^0-9+\-*/().%\s]/g, '');
-                const result = eval(safeExpr);
+                const result = evaluateExpression(expr);
                 return {
                     content: [{
                         type: "text",
@@ -2,6 +2,10 @@
 """
 MCP HTTP Server с системой напоминаний и агентом 24/7
 Запуск: python3 server.py
+
+Зависимости (необязательные): pip install -r requirements.txt
+Для лучшей производительности запускайте под PyPy3 (pypy3 server.py):
+C-расширения подключаются только если установлены, горячие пути на чистом Python
 """
 
 import sys
@@ -9,18 +13,43 @@ import os
 # Добавляем пользовательские пакеты Python в путь
 sys.path.insert(0, os.path.expanduser('~/Library/Python/3.9/lib/python/site-packages'))
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import io
 import json
+import logging
+import re
 import socket
+import queue
 import random
+import sched
 import sqlite3
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import urllib.request
 import urllib.parse
 import os
 
+try:
+    import orjson  # Быстрый разбор и сериализация JSON (необязательно)
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # Потоковый разбор JSON (необязательно)
+except ImportError:
+    ijson = None
+
+try:
+    import requests  # Нужен для Todoist и пула соединений (необязательно)
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    _HAS_REQUESTS = True
+except ImportError:
+    requests = None
+    _HAS_REQUESTS = False
+
 # ============================================
 # CONFIGURATION
 # ============================================
@@ -29,15 +58,164 @@ import os
 TODOIST_API_TOKEN = os.getenv("TODOIST_API_TOKEN", "")
 TODOIST_PROJECT_ID = os.getenv("TODOIST_PROJECT_ID", "")  # ID проекта (необязательно)
 
+# Токен, заданный через /set_todoist_token, хранится в файле: переживает
+# перезапуск и виден всем процессам. Пока файла нет, берется из окружения
+TODOIST_TOKEN_FILE = ".todoist_token"
+_token_cache = (None, "")  # ((mtime_ns, размер) файла, токен)
+
+def get_todoist_token():
+    """Текущий токен Todoist (файл перечитывается только после изменения)"""
+    global _token_cache
+    try:
+        st = os.stat(TODOIST_TOKEN_FILE)
+    except FileNotFoundError:
+        return TODOIST_API_TOKEN
+    
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached_stamp, token = _token_cache
+    if stamp != cached_stamp:
+        with open(TODOIST_TOKEN_FILE, encoding="utf-8") as f:
+            token = f.read().strip()
+        _token_cache = (stamp, token)
+    return token
+
+def set_todoist_token(token):
+    """Сохранить токен Todoist атомарно: запись во временный файл и замена"""
+    tmp_path = f"{TODOIST_TOKEN_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(token)
+        os.replace(tmp_path, TODOIST_TOKEN_FILE)
+    except BaseException:
+        # Не оставляем временный файл, если запись или замена не удались
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+# Потоков-обработчиков HTTP-запросов. Пул исходящих соединений того же
+# размера, чтобы параллельные запросы не выбрасывали keep-alive соединения
+HTTP_WORKERS = 32
+
+# Максимальный размер тела POST-запроса, байт
+MAX_BODY = 1 << 20
+
+# ============================================
+# HTTP SESSIONS
+# ============================================
+
+# Keep-alive сессии переиспользуются между запросами,
+# чтобы не платить за TCP+TLS рукопожатие на каждом вызове
+def _build_session(pool_maxsize, retry):
+    """Создать requests.Session с пулом соединений и повторами"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry))
+    return session
+
+if _HAS_REQUESTS:
+    _TODOIST_SESSION = _build_session(
+        pool_maxsize=4,
+        retry=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+    )
+    _TODOIST_SESSION.headers["Content-Type"] = "application/json"
+    # Погода: повторяем только неудачное подключение. Повтор после таймаута
+    # чтения или ожидание по Retry-After растянули бы ответ до минуты
+    _HTTP_SESSION = _build_session(
+        pool_maxsize=HTTP_WORKERS,
+        retry=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3, respect_retry_after_header=False),
+    )
+    _HTTP_SESSION.headers["User-Agent"] = "Mozilla/5.0"
+else:
+    _TODOIST_SESSION = None
+    _HTTP_SESSION = None
+
+def http_get(url, timeout):
+    """GET-запрос через общую сессию, возвращает тело ответа в байтах"""
+    if not _HAS_REQUESTS:
+        # Без requests работаем через urllib (без переиспользования соединений)
+        req = urllib.request.Request(url)
+        req.add_header('User-Agent', 'Mozilla/5.0')
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.read()
+    
+    response = _HTTP_SESSION.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
 # ============================================
 # DATABASE
 # ============================================
 
 DB_FILE = "tasks.db"
 
+# Метка задачи Todoist в описании: [TODOIST-123456]
+_TODOIST_RE = re.compile(r'\[TODOIST-([^\]]+)\]')
+
+# WAL позволяет читателям не блокироваться писателями (HTTP + планировщики)
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+def _connect():
+    """Открыть соединение с БД с настроенными PRAGMA"""
+    conn = sqlite3.connect(DB_FILE)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Соединения живут в потоке и переиспользуются между вызовами
+_tls = threading.local()
+
+# Все записи в БД идут последовательно: SQLite не видит конкурирующих
+# писателей и не уходит в ожидание busy_timeout. Чтение блокировку не берет
+_DB_WRITE_LOCK = threading.Lock()
+
+def _conn():
+    """Соединение с БД текущего потока (создается при первом обращении)"""
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _tls.conn = conn
+    return conn
+
+# Запросы рабочих функций. Один и тот же объект строки на каждом вызове
+# попадает в кэш подготовленных выражений соединения (cached_statements)
+_STMTS = {
+    'add_task': '''
+        INSERT INTO tasks (title, description, created_at, user_token)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'list_tasks': 'SELECT * FROM tasks ORDER BY created_at DESC',
+    'list_tasks_by_status': 'SELECT * FROM tasks WHERE status = ? ORDER BY created_at DESC',
+    'complete_task': '''
+        UPDATE tasks
+        SET status = 'completed', completed_at = ?
+        WHERE id = ?
+    ''',
+    'daily_counters': 'SELECT created_count, completed_count FROM daily_counters WHERE date = ?',
+    'pending_count': "SELECT COUNT(*) FROM tasks WHERE status = 'pending'",
+    # Даты хранятся в ISO-формате, поэтому диапазон эквивалентен
+    # DATE(...) = ? и использует индекс по completed_at
+    'completed_between': '''
+        SELECT id, title, description FROM tasks
+        WHERE completed_at >= ? AND completed_at < ?
+    ''',
+    'save_daily_summary': '''
+        INSERT INTO daily_summaries (date, summary, tasks_completed, created_at)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'local_todoist_index': 'SELECT id, status, todoist_id FROM tasks WHERE todoist_id IS NOT NULL',
+}
+
 def init_database():
     """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -48,10 +226,53 @@ def init_database():
             created_at TEXT NOT NULL,
             completed_at TEXT,
             status TEXT DEFAULT 'pending',
-            user_token TEXT
+            user_token TEXT,
+            todoist_id TEXT
         )
     ''')
     
+    # Миграция старых БД: отдельная колонка для ID задачи Todoist
+    try:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN todoist_id TEXT')
+        todoist_column_added = True
+    except sqlite3.OperationalError:
+        todoist_column_added = False  # Колонка уже есть
+    
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_todoist_id
+        ON tasks(todoist_id) WHERE todoist_id IS NOT NULL
+    ''')
+    
+    if todoist_column_added:
+        # Первый запуск с колонкой todoist_id - заполняем ее для задач,
+        # импортированных раньше. Старый импорт мог создать несколько строк
+        # на одну задачу Todoist: связываем одну из них, предпочитая
+        # выполненную (чтобы не потерять локальное завершение), остальные
+        # остаются несвязанными и не удаляются
+        cursor.execute('''
+            SELECT id, description, status FROM tasks
+            WHERE description LIKE '%[TODOIST-%'
+            ORDER BY id
+        ''')
+        candidates = {}  # todoist_id -> (id, status)
+        for row_id, desc, status in cursor.fetchall():
+            match = _TODOIST_RE.search(desc)
+            if not match:
+                continue
+            todoist_id = match.group(1)
+            kept = candidates.get(todoist_id)
+            if kept is None or (kept[1] != "completed" and status == "completed"):
+                candidates[todoist_id] = (row_id, status)
+        cursor.executemany(
+            'UPDATE tasks SET todoist_id = ? WHERE id = ?',
+            [(todoist_id, row_id) for todoist_id, (row_id, _) in candidates.items()]
+        )
+    
+    # Индексы для сводки за день
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_completed_at ON tasks(completed_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS daily_summaries (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -62,6 +283,73 @@ def init_database():
         )
     ''')
     
+    # Счетчики задач по дням, которые поддерживаются триггерами на tasks.
+    # День берется как первые 10 символов ISO-даты (YYYY-MM-DD)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_counters'")
+    counters_exist = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_counters (
+            date TEXT PRIMARY KEY NOT NULL,
+            created_count INTEGER NOT NULL DEFAULT 0,
+            completed_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    if not counters_exist:
+        # Первый запуск с daily_counters - заполняем по текущим задачам
+        cursor.execute('''
+            INSERT INTO daily_counters (date, created_count)
+            SELECT substr(created_at, 1, 10), COUNT(*) FROM tasks GROUP BY 1
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO daily_counters (date)
+            SELECT DISTINCT substr(completed_at, 1, 10) FROM tasks
+        ''')
+        cursor.execute('''
+            UPDATE daily_counters SET completed_count = (
+                SELECT COUNT(*) FROM tasks WHERE substr(completed_at, 1, 10) = daily_counters.date
+            )
+        ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_counters_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT OR IGNORE INTO daily_counters (date) VALUES (substr(NEW.created_at, 1, 10));
+            UPDATE daily_counters SET created_count = created_count + 1
+            WHERE date = substr(NEW.created_at, 1, 10);
+            INSERT OR IGNORE INTO daily_counters (date) VALUES (substr(NEW.completed_at, 1, 10));
+            UPDATE daily_counters SET completed_count = completed_count + 1
+            WHERE date = substr(NEW.completed_at, 1, 10);
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_counters_delete AFTER DELETE ON tasks
+        BEGIN
+            UPDATE daily_counters SET created_count = created_count - 1
+            WHERE date = substr(OLD.created_at, 1, 10);
+            UPDATE daily_counters SET completed_count = completed_count - 1
+            WHERE date = substr(OLD.completed_at, 1, 10);
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_counters_update AFTER UPDATE OF created_at, completed_at ON tasks
+        BEGIN
+            UPDATE daily_counters SET created_count = created_count - 1
+            WHERE date = substr(OLD.created_at, 1, 10);
+            UPDATE daily_counters SET completed_count = completed_count - 1
+            WHERE date = substr(OLD.completed_at, 1, 10);
+            INSERT OR IGNORE INTO daily_counters (date) VALUES (substr(NEW.created_at, 1, 10));
+            UPDATE daily_counters SET created_count = created_count + 1
+            WHERE date = substr(NEW.created_at, 1, 10);
+            INSERT OR IGNORE INTO daily_counters (date) VALUES (substr(NEW.completed_at, 1, 10));
+            UPDATE daily_counters SET completed_count = completed_count + 1
+            WHERE date = substr(NEW.completed_at, 1, 10);
+        END
+    ''')
+    
     conn.commit()
     conn.close()
     print("✅ База данных инициализирована")
@@ -72,30 +360,24 @@ def init_database():
 
 def add_task(title, description="", user_token=None):
     """Добавить новую задачу"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
     
     now = datetime.now().isoformat()
-    cursor.execute('''
-        INSERT INTO tasks (title, description, created_at, user_token)
-        VALUES (?, ?, ?, ?)
-    ''', (title, description, now, user_token))
+    with _DB_WRITE_LOCK, conn:
+        cursor.execute(_STMTS['add_task'], (title, description, now, user_token))
     
-    task_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return task_id
+    return cursor.lastrowid
 
 def list_tasks(status=None):
     """Получить список задач"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
     
     if status:
-        cursor.execute('SELECT * FROM tasks WHERE status = ? ORDER BY created_at DESC', (status,))
+        cursor.execute(_STMTS['list_tasks_by_status'], (status,))
     else:
-        cursor.execute('SELECT * FROM tasks ORDER BY created_at DESC')
+        cursor.execute(_STMTS['list_tasks'])
     
     tasks = []
     for row in cursor.fetchall():
@@ -108,43 +390,37 @@ def list_tasks(status=None):
             'status': row[5]
         })
     
-    conn.close()
     return tasks
 
 def complete_task(task_id):
     """Отметить задачу как выполненную"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
     
     now = datetime.now().isoformat()
-    cursor.execute('''
-        UPDATE tasks 
-        SET status = 'completed', completed_at = ?
-        WHERE id = ?
-    ''', (now, task_id))
-    
-    conn.commit()
-    conn.close()
+    with _DB_WRITE_LOCK, conn:
+        cursor.execute(_STMTS['complete_task'], (now, task_id))
 
 def get_today_summary():
     """Получить сводку задач за сегодня"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
     
-    today = datetime.now().date().isoformat()
+    today_date = datetime.now().date()
+    today = today_date.isoformat()
+    tomorrow = (today_date + timedelta(days=1)).isoformat()
     
-    # Задачи, созданные сегодня
-    cursor.execute('''
-        SELECT COUNT(*) FROM tasks 
-        WHERE DATE(created_at) = ?
-    ''', (today,))
-    created_today = cursor.fetchone()[0]
+    # Счетчики за день ведут триггеры, здесь только чтение одной строки
+    cursor.execute(_STMTS['daily_counters'], (today,))
+    row = cursor.fetchone()
+    created_today, completed_today = row if row else (0, 0)
+    
+    # Активные задачи считаются по индексу idx_tasks_status
+    cursor.execute(_STMTS['pending_count'])
+    pending_count = cursor.fetchone()[0]
     
     # Задачи, завершенные сегодня
-    cursor.execute('''
-        SELECT * FROM tasks 
-        WHERE DATE(completed_at) = ?
-    ''', (today,))
+    cursor.execute(_STMTS['completed_between'], (today, tomorrow))
     
     completed_tasks = []
     for row in cursor.fetchall():
@@ -154,68 +430,93 @@ def get_today_summary():
             'description': row[2]
         })
     
-    # Всего активных задач
-    cursor.execute('SELECT COUNT(*) FROM tasks WHERE status = "pending"')
-    pending_count = cursor.fetchone()[0]
-    
-    conn.close()
-    
     return {
         'date': today,
         'created_today': created_today,
-        'completed_today': len(completed_tasks),
+        'completed_today': completed_today,
         'completed_tasks': completed_tasks,
         'pending_count': pending_count
     }
 
 def save_daily_summary(summary_data):
     """Сохранить ежедневную сводку"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = _conn()
     cursor = conn.cursor()
     
     now = datetime.now().isoformat()
     summary_text = format_summary(summary_data)
     
-    cursor.execute('''
-        INSERT INTO daily_summaries (date, summary, tasks_completed, created_at)
-        VALUES (?, ?, ?, ?)
-    ''', (summary_data['date'], summary_text, summary_data['completed_today'], now))
-    
-    conn.commit()
-    conn.close()
+    with _DB_WRITE_LOCK, conn:
+        cursor.execute(_STMTS['save_daily_summary'], (summary_data['date'], summary_text, summary_data['completed_today'], now))
 
 def format_summary(summary_data):
     """Форматировать сводку для отображения"""
-    text = f"📊 Сводка за {summary_data['date']}\n\n"
-    text += f"✅ Выполнено задач: {summary_data['completed_today']}\n"
-    text += f"📝 Создано задач: {summary_data['created_today']}\n"
-    text += f"⏳ Осталось активных: {summary_data['pending_count']}\n\n"
+    parts = [
+        f"📊 Сводка за {summary_data['date']}\n\n",
+        f"✅ Выполнено задач: {summary_data['completed_today']}\n",
+        f"📝 Создано задач: {summary_data['created_today']}\n",
+        f"⏳ Осталось активных: {summary_data['pending_count']}\n\n",
+    ]
     
     if summary_data['completed_tasks']:
-        text += "Завершенные задачи:\n"
+        parts.append("Завершенные задачи:\n")
         for i, task in enumerate(summary_data['completed_tasks'], 1):
-            text += f"{i}. {task['title']}\n"
+            parts.append(f"{i}. {task['title']}\n")
     else:
-        text += "Сегодня не было завершено ни одной задачи 😔\n"
+        parts.append("Сегодня не было завершено ни одной задачи 😔\n")
     
-    return text
+    return "".join(parts)
 
 # ============================================
 # TODOIST INTEGRATION
 # ============================================
 
+TODOIST_TASKS_URL = "https://api.todoist.com/rest/v2/tasks"
+
+def _fetch_local_todoist_index():
+    """Индекс уже импортированных задач: todoist_id -> (id, status)"""
+    cursor = _conn().cursor()
+    cursor.execute(_STMTS['local_todoist_index'])
+    local_index = {}
+    for row_id, status, todoist_id in cursor.fetchall():
+        local_index[todoist_id] = (row_id, status)
+    return local_index
+
+def _insert_todoist_tasks(cursor, rows):
+    """Вставить задачи Todoist (title, description, created_at, status, todoist_id).
+    
+    Вызывается внутри транзакции записи. Задачи, уже связанные с этим
+    todoist_id, пропускаются. Возвращает (число вставленных, вставленные строки)
+    """
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS _new_ids (id TEXT PRIMARY KEY)')
+    cursor.execute('DELETE FROM _new_ids')
+    cursor.executemany('INSERT OR IGNORE INTO _new_ids VALUES (?)', [(row[4],) for row in rows])
+    cursor.execute('SELECT todoist_id FROM tasks WHERE todoist_id IN (SELECT id FROM _new_ids)')
+    linked_ids = {row[0] for row in cursor.fetchall()}
+    
+    fresh = {}
+    for row in rows:
+        if row[4] not in linked_ids:
+            fresh.setdefault(row[4], row)
+    fresh_rows = list(fresh.values())
+    
+    cursor.executemany('''
+        INSERT OR IGNORE INTO tasks (title, description, created_at, status, todoist_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', fresh_rows)
+    return cursor.rowcount, fresh_rows
+
 def sync_with_todoist():
     """
     Синхронизация задач с Todoist
     Возвращает количество импортированных задач
     """
-    if not TODOIST_API_TOKEN:
+    token = get_todoist_token()
+    if not token:
         print("⚠️  Todoist не настроен (нет API токена)")
         return 0
     
-    try:
-        import requests  # Импортируем только когда нужно
-    except ImportError:
+    if not _HAS_REQUESTS:
         print("❌ Модуль 'requests' не установлен")
         print("   Установите: pip3 install requests")
         return 0
@@ -223,17 +524,18 @@ def sync_with_todoist():
     try:
         print(f"\n🔄 Синхронизация с Todoist...")
         
-        headers = {
-            "Authorization": f"Bearer {TODOIST_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
+        headers = {"Authorization": f"Bearer {token}"}
         
-        # Получаем все активные задачи
-        response = requests.get(
-            "https://api.todoist.com/rest/v2/tasks",
-            headers=headers,
-            timeout=10
-        )
+        # Запрос к Todoist идет в фоне, пока читаем локальные задачи
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            http_future = executor.submit(
+                _TODOIST_SESSION.get,
+                TODOIST_TASKS_URL,
+                headers=headers,
+                timeout=10
+            )
+            local_index = _fetch_local_todoist_index()
+            response = http_future.result()
         
         if response.status_code != 200:
             print(f"❌ Ошибка API Todoist: {response.status_code}")
@@ -241,75 +543,59 @@ def sync_with_todoist():
             return 0
         
         tasks_data = response.json()
-        imported_count = 0
-        updated_count = 0
-        deleted_count = 0
         
         # Собираем ID всех задач из Todoist
         todoist_task_ids = set()
         for task in tasks_data:
             todoist_task_ids.add(str(task.get("id", "")))
         
-        # Импортируем задачи в нашу БД
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        to_insert = []
+        to_update_status = []
+        now = datetime.now().isoformat()
         
         for task in tasks_data:
-            task_id = task.get("id", "")
+            task_id = str(task.get("id", ""))
             content = task.get("content", "")
             description = task.get("description", "")
             is_completed = task.get("is_completed", False)
             created_at = task.get("created_at", "")
+            task_status = "completed" if is_completed else "pending"
             
-            # Проверяем, есть ли уже такая задача (по ID Todoist)
-            cursor.execute(
-                'SELECT id, status FROM tasks WHERE description LIKE ?',
-                (f"%[TODOIST-{task_id}]%",)
-            )
-            existing = cursor.fetchone()
-            
+            existing = local_index.get(task_id)
             if existing:
                 # Обновляем статус существующей задачи
-                task_status = "completed" if is_completed else "pending"
                 if existing[1] != task_status:
-                    cursor.execute(
-                        'UPDATE tasks SET status = ? WHERE id = ?',
-                        (task_status, existing[0])
-                    )
-                    updated_count += 1
+                    to_update_status.append((task_status, existing[0]))
                     print(f"  🔄 Обновлено: {content}")
             else:
                 # Добавляем новую задачу
-                now = datetime.now().isoformat()
                 full_description = f"[TODOIST-{task_id}] {description}" if description else f"[TODOIST-{task_id}]"
-                task_status = "completed" if is_completed else "pending"
-                
-                cursor.execute('''
-                    INSERT INTO tasks (title, description, created_at, status)
-                    VALUES (?, ?, ?, ?)
-                ''', (content, full_description, created_at or now, task_status))
-                
-                imported_count += 1
-                print(f"  ✅ Импортировано: {content}")
-        
-        # Удаляем задачи которых больше нет в Todoist
-        cursor.execute('SELECT id, title, description FROM tasks WHERE description LIKE "%[TODOIST-%"')
-        local_tasks = cursor.fetchall()
-        
-        for local_task in local_tasks:
-            task_id, title, desc = local_task
-            # Извлекаем Todoist ID из описания
-            if "[TODOIST-" in desc:
-                todoist_id = desc.split("[TODOIST-")[1].split("]")[0]
-                
-                # Если этой задачи нет в Todoist - удаляем из локальной БД
-                if todoist_id not in todoist_task_ids:
-                    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-                    deleted_count += 1
-                    print(f"  🗑️ Удалено (не найдено в Todoist): {title}")
+                to_insert.append((content, full_description, created_at or now, task_status, task_id))
+        
+        # Все изменения применяются в одной транзакции. Индекс читался до нее,
+        # поэтому задачи, успевшие появиться параллельно, пропускаются при вставке
+        conn = _conn()
+        cursor = conn.cursor()
+        with _DB_WRITE_LOCK, conn:
+            cursor.execute("BEGIN IMMEDIATE")
+            imported_count, inserted_rows = _insert_todoist_tasks(cursor, to_insert)
+            cursor.executemany('UPDATE tasks SET status = ? WHERE id = ?', to_update_status)
+            
+            # Удаляем задачи которых больше нет в Todoist: ID из ответа
+            # кладем во временную таблицу и удаляем одним anti-join запросом
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS _remote_ids (id TEXT PRIMARY KEY)')
+            cursor.execute('DELETE FROM _remote_ids')
+            cursor.executemany('INSERT OR IGNORE INTO _remote_ids VALUES (?)', [(i,) for i in todoist_task_ids])
+            cursor.execute('''
+                DELETE FROM tasks
+                WHERE todoist_id IS NOT NULL AND todoist_id NOT IN (SELECT id FROM _remote_ids)
+            ''')
+            deleted_count = cursor.rowcount
         
-        conn.commit()
-        conn.close()
+        for row in inserted_rows:
+            print(f"  ✅ Импортировано: {row[0]}")
+        
+        updated_count = len(to_update_status)
         
         print(f"\n✅ Синхронизация завершена:")
         print(f"   📥 Импортировано новых: {imported_count}")
@@ -357,6 +643,52 @@ def send_push_notification(title, body, data=None):
 # BACKGROUND SCHEDULER
 # ============================================
 
+# Общий диспетчер заданий: один поток спит до ближайшего события в куче.
+# Время по настенным часам, а сон ограничен минутой, чтобы после сна
+# ноутбука просроченные задания срабатывали сразу
+_SCHED_MAX_SLEEP = 60
+_SCHED_WAKE = threading.Event()  # Будит диспетчер при добавлении/отмене заданий
+
+def _sched_delay(seconds):
+    """Ожидание диспетчера: прерывается при изменении очереди"""
+    _SCHED_WAKE.wait(timeout=min(seconds, _SCHED_MAX_SLEEP))
+    _SCHED_WAKE.clear()
+
+_SCHED = sched.scheduler(time.time, _sched_delay)
+_SCHED_THREAD = None
+_SCHED_THREAD_LOCK = threading.Lock()
+
+def _sched_loop():
+    """Основной цикл диспетчера"""
+    while True:
+        try:
+            _SCHED.run()
+        except Exception as e:
+            print(f"❌ Ошибка фонового задания: {e}")
+            continue
+        # Очередь пуста - ждем новых заданий
+        _SCHED_WAKE.wait()
+        _SCHED_WAKE.clear()
+
+def _sched_enter(delay, action):
+    """Поставить задание в очередь диспетчера (поток запускается при первом вызове)"""
+    global _SCHED_THREAD
+    with _SCHED_THREAD_LOCK:
+        if _SCHED_THREAD is None:
+            _SCHED_THREAD = threading.Thread(target=_sched_loop, daemon=True)
+            _SCHED_THREAD.start()
+    event = _SCHED.enter(delay, 0, action)
+    _SCHED_WAKE.set()
+    return event
+
+def _sched_cancel(event):
+    """Убрать задание из очереди (если оно еще не выполнено)"""
+    try:
+        _SCHED.cancel(event)
+    except ValueError:
+        return  # Задание уже выполнено или отменено
+    _SCHED_WAKE.set()
+
 class DailyScheduler:
     """Планировщик для ежедневных сводок"""
     
@@ -364,24 +696,29 @@ class DailyScheduler:
         self.hour = hour
         self.minute = minute
         self.running = False
-        self.thread = None
+        self._event = None
+        self._lock = threading.Lock()
     
     def start(self):
         """Запустить планировщик"""
         self.running = True
-        self.thread = threading.Thread(target=self._run, daemon=True)
-        self.thread.start()
         print(f"⏰ Планировщик запущен: ежедневная сводка в {self.hour:02d}:{self.minute:02d}")
+        self._schedule_next()
     
     def stop(self):
         """Остановить планировщик"""
         self.running = False
-        if self.thread:
-            self.thread.join()
+        with self._lock:
+            if self._event is not None:
+                _sched_cancel(self._event)
+                self._event = None
     
-    def _run(self):
-        """Основной цикл планировщика"""
-        while self.running:
+    def _schedule_next(self):
+        """Поставить следующую сводку в очередь диспетчера"""
+        with self._lock:
+            if not self.running:
+                return
+            
             now = datetime.now()
             target_time = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
             
@@ -393,14 +730,14 @@ class DailyScheduler:
             wait_seconds = (target_time - now).total_seconds()
             
             print(f"⏰ Следующая сводка: {target_time.strftime('%Y-%m-%d %H:%M:%S')} (через {wait_seconds/3600:.1f} часов)")
-            
-            # Ждем до целевого времени (проверяем каждую минуту)
-            while self.running and datetime.now() < target_time:
-                time.sleep(60)  # Проверяем каждую минуту
-            
-            # Отправляем сводку
-            if self.running:
-                self._send_daily_summary()
+            self._event = _sched_enter(wait_seconds, self._run)
+    
+    def _run(self):
+        """Отправить сводку и запланировать следующую"""
+        try:
+            self._send_daily_summary()
+        finally:
+            self._schedule_next()
     
     def _send_daily_summary(self):
         """Отправить ежедневную сводку"""
@@ -437,25 +774,26 @@ class PeriodicSyncScheduler:
     def __init__(self, interval_minutes=30):
         self.interval_minutes = interval_minutes
         self.running = False
-        self.thread = None
         self.last_sync_time = None
-        self.known_task_ids = set()  # ID задач которые уже видели
-        self.interval_changed = False  # Флаг изменения интервала
+        self.known_task_ids = frozenset()  # ID задач которые уже видели (заменяется целиком)
+        self._event = None
+        self._lock = threading.Lock()
         
     def start(self):
         """Запустить планировщик"""
         self.running = True
         # Загружаем существующие задачи в known_task_ids
         self._load_existing_tasks()
-        self.thread = threading.Thread(target=self._run, daemon=True)
-        self.thread.start()
         print(f"🔄 Периодическая синхронизация запущена: каждые {self.interval_minutes} минут")
+        self._schedule_next()
     
     def stop(self):
         """Остановить планировщик"""
         self.running = False
-        if self.thread:
-            self.thread.join()
+        with self._lock:
+            if self._event is not None:
+                _sched_cancel(self._event)
+                self._event = None
     
     def set_interval(self, minutes):
         """Изменить интервал синхронизации"""
@@ -465,74 +803,63 @@ class PeriodicSyncScheduler:
         
         old_interval = self.interval_minutes
         self.interval_minutes = minutes
-        self.interval_changed = True
         print(f"✅ Интервал изменен: {old_interval} → {minutes} минут")
+        
+        # Перезапускаем таймер с новым интервалом
+        self._schedule_next()
         return True
     
+    def _schedule_next(self):
+        """Поставить следующую проверку в очередь диспетчера, отменив прежнюю"""
+        with self._lock:
+            if self._event is not None:
+                _sched_cancel(self._event)
+                self._event = None
+            if not self.running:
+                return
+            
+            print(f"⏰ Следующая синхронизация через {self.interval_minutes} минут")
+            self._event = _sched_enter(self.interval_minutes * 60, self._run)
+    
     def _load_existing_tasks(self):
         """Загрузить ID существующих задач из БД"""
         try:
-            conn = sqlite3.connect(DB_FILE)
+            conn = _conn()
             cursor = conn.cursor()
-            cursor.execute('SELECT description FROM tasks')
+            cursor.execute('SELECT todoist_id FROM tasks WHERE todoist_id IS NOT NULL')
             rows = cursor.fetchall()
-            conn.close()
             
-            # Извлекаем Todoist ID из описаний вида [TODOIST-123456]
-            for row in rows:
-                desc = row[0] or ""
-                if "[TODOIST-" in desc:
-                    todoist_id = desc.split("[TODOIST-")[1].split("]")[0]
-                    self.known_task_ids.add(todoist_id)
+            self.known_task_ids = self.known_task_ids | {row[0] for row in rows}
             
             print(f"   Загружено {len(self.known_task_ids)} существующих задач")
         except Exception as e:
             print(f"⚠️  Ошибка загрузки задач: {e}")
     
     def _run(self):
-        """Основной цикл планировщика"""
-        while self.running:
-            # Ждем interval_minutes
-            wait_seconds = self.interval_minutes * 60
-            print(f"⏰ Следующая синхронизация через {self.interval_minutes} минут")
-            
-            # Ждем с проверкой изменения интервала
-            elapsed = 0
-            while elapsed < wait_seconds and self.running:
-                if self.interval_changed:
-                    # Интервал изменился - перезапускаем ожидание
-                    self.interval_changed = False
-                    print(f"🔄 Перезапуск таймера с новым интервалом: {self.interval_minutes} минут")
-                    break
-                time.sleep(1)
-                elapsed += 1
-            
-            # Если интервал не был изменен и таймер истек - проверяем задачи
-            if not self.interval_changed and elapsed >= wait_seconds and self.running:
-                self._check_for_new_tasks()
+        """Проверить задачи и запланировать следующую проверку"""
+        try:
+            self._check_for_new_tasks()
+        finally:
+            self._schedule_next()
     
     def _check_for_new_tasks(self):
         """Проверить новые задачи в Todoist"""
-        if not TODOIST_API_TOKEN:
+        token = get_todoist_token()
+        if not token:
             return
         
-        try:
-            import requests
-        except ImportError:
+        if not _HAS_REQUESTS:
             print("❌ Модуль 'requests' не установлен")
             return
         
         try:
             print(f"\n🔍 Проверка новых задач в Todoist...")
             
-            headers = {
-                "Authorization": f"Bearer {TODOIST_API_TOKEN}",
-                "Content-Type": "application/json"
-            }
+            headers = {"Authorization": f"Bearer {token}"}
             
             # Получаем все активные задачи
-            response = requests.get(
-                "https://api.todoist.com/rest/v2/tasks",
+            response = _TODOIST_SESSION.get(
+                TODOIST_TASKS_URL,
                 headers=headers,
                 timeout=10
             )
@@ -542,14 +869,13 @@ class PeriodicSyncScheduler:
                 return
             
             tasks_data = response.json()
-            new_tasks = []
             
-            # Проверяем какие задачи новые
-            for task in tasks_data:
-                task_id = str(task.get("id", ""))
-                if task_id not in self.known_task_ids:
-                    new_tasks.append(task)
-                    self.known_task_ids.add(task_id)
+            # Проверяем какие задачи новые по снимку известных ID,
+            # затем атомарно подменяем снимок новым
+            known = self.known_task_ids
+            remote_ids = {str(task.get("id", "")) for task in tasks_data}
+            new_tasks = [task for task in tasks_data if str(task.get("id", "")) not in known]
+            self.known_task_ids = known | remote_ids
             
             if new_tasks:
                 print(f"✨ Найдено новых задач: {len(new_tasks)}")
@@ -577,9 +903,11 @@ class PeriodicSyncScheduler:
     def _import_new_tasks(self, tasks):
         """Импортировать новые задачи в БД"""
         try:
-            conn = sqlite3.connect(DB_FILE)
+            conn = _conn()
             cursor = conn.cursor()
             
+            now = datetime.now().isoformat()
+            rows = []
             for task in tasks:
                 task_id = task.get("id", "")
                 content = task.get("content", "")
@@ -587,19 +915,17 @@ class PeriodicSyncScheduler:
                 is_completed = task.get("is_completed", False)
                 created_at = task.get("created_at", "")
                 
-                now = datetime.now().isoformat()
                 full_description = f"[TODOIST-{task_id}] {description}" if description else f"[TODOIST-{task_id}]"
                 task_status = "completed" if is_completed else "pending"
-                
-                cursor.execute('''
-                    INSERT INTO tasks (title, description, created_at, status)
-                    VALUES (?, ?, ?, ?)
-                ''', (content, full_description, created_at or now, task_status))
-                
-                print(f"   ✅ Импортировано: {content}")
+                rows.append((content, full_description, created_at or now, task_status, str(task_id)))
+            
+            # Задачи, уже связанные с этим todoist_id, пропускаются
+            with _DB_WRITE_LOCK, conn:
+                cursor.execute("BEGIN IMMEDIATE")
+                _, inserted_rows = _insert_todoist_tasks(cursor, rows)
             
-            conn.commit()
-            conn.close()
+            if inserted_rows:
+                print("\n".join(f"   ✅ Импортировано: {row[0]}" for row in inserted_rows))
             
         except Exception as e:
             print(f"❌ Ошибка импорта задач: {e}")
@@ -608,37 +934,118 @@ class PeriodicSyncScheduler:
 # WEATHER API
 # ============================================
 
+# Кэш погоды: город -> (время получения по time.monotonic, текст ответа).
+# Порядок ключей - от давно использованных к недавним (LRU)
+_WEATHER_CACHE = {}
+_WEATHER_CACHE_LOCK = threading.Lock()
+_WEATHER_TTL = 300  # секунд
+_WEATHER_CACHE_MAX = 256  # городов
+
+# Компактный формат wttr.in: только нужные поля через "|" вместо полного JSON
+_WTTR_COMPACT_FORMAT = urllib.parse.quote("%t|%f|%h|%C|%w")
+_NUMBER_RE = re.compile(r'-?\d+')
+
+def _fetch_weather_compact(city_encoded):
+    """Погода в компактном текстовом формате (ValueError, если ответ не распознан)"""
+    url = f"https://wttr.in/{city_encoded}?format={_WTTR_COMPACT_FORMAT}&m"
+    fields = http_get(url, timeout=15).decode().strip().split("|")
+    if len(fields) != 5:
+        raise ValueError(f"Неожиданный ответ wttr.in: {fields[0][:50]}")
+    
+    temp, feels_like, humidity, weather_desc, wind = fields
+    numbers = [_NUMBER_RE.search(value) for value in (temp, feels_like, humidity, wind)]
+    if not all(numbers):
+        raise ValueError(f"Неожиданный ответ wttr.in: {'|'.join(fields)[:50]}")
+    
+    temp, feels_like, humidity, wind_speed = (match.group() for match in numbers)
+    return temp, feels_like, humidity, weather_desc.strip(), wind_speed
+
+def _fetch_weather_j1(city_encoded):
+    """Погода из полного JSON-ответа wttr.in (format=j1)"""
+    url = f"https://wttr.in/{city_encoded}?format=j1"
+    body = http_get(url, timeout=15)
+    
+    if ijson is not None:
+        # current_condition идет в ответе первым: разбор останавливается на
+        # его первом элементе, прогноз на дни в объекты не превращается
+        current = next(ijson.items(io.BytesIO(body), 'current_condition.item'), None)
+        if current is None:
+            raise KeyError('current_condition')
+    else:
+        current = json_loads(body)['current_condition'][0]
+    return (
+        current['temp_C'],
+        current['FeelsLikeC'],
+        current['humidity'],
+        current['weatherDesc'][0]['value'],
+        current['windspeedKmph'],
+    )
+
+# Демо-ответ, когда wttr.in недоступен
+_FALLBACK_TMPL = (
+    "🌍 Демо погода для {city}:\n"
+    "🌡️ Температура: {t}°C\n"
+    "☁️ Условия: Переменная облачность\n"
+    "💧 Влажность: {h}%\n"
+    "⚠️ Примечание: Реальное API недоступно ({err})"
+)
+
+def _rng():
+    """Генератор случайных чисел текущего потока (без общей блокировки модуля random)"""
+    rng = getattr(_tls, 'rng', None)
+    if rng is None:
+        rng = random.Random()  # Сид из os.urandom
+        _tls.rng = rng
+    return rng
+
+def _demo_weather(city, error):
+    """Демо-погода вместо реальной (API недоступно или город не задан строкой)"""
+    rng = _rng()
+    return _FALLBACK_TMPL.format_map({
+        'city': city,
+        't': rng.randint(15, 25),
+        'h': rng.randint(40, 70),
+        'err': str(error)[:50] if error.args else "",
+    })
+
 def get_real_weather(city):
     """Получить реальную погоду через wttr.in API"""
+    if not isinstance(city, str):
+        # Аргумент приходит из JSON: не строку в wttr.in не отправляем
+        return _demo_weather(city, TypeError(f"город должен быть строкой, а не {type(city).__name__}"))
+    
+    key = city.strip().lower()
+    with _WEATHER_CACHE_LOCK:
+        cached = _WEATHER_CACHE.pop(key, None)
+        if cached is not None and time.monotonic() - cached[0] < _WEATHER_TTL:
+            _WEATHER_CACHE[key] = cached  # Переносим в конец как недавно использованный
+            return cached[1]
+    
     try:
         city_encoded = urllib.parse.quote(city)
-        url = f"https://wttr.in/{city_encoded}?format=j1"
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0')
+        try:
+            weather = _fetch_weather_compact(city_encoded)
+        except ValueError:
+            # Нераспознанный компактный ответ - пробуем полный JSON
+            weather = _fetch_weather_j1(city_encoded)
+        temp, feels_like, humidity, weather_desc, wind_speed = weather
         
-        with urllib.request.urlopen(req, timeout=15) as response:
-            data = json.loads(response.read().decode())
-            
-            current = data['current_condition'][0]
-            temp = current['temp_C']
-            feels_like = current['FeelsLikeC']
-            humidity = current['humidity']
-            weather_desc = current['weatherDesc'][0]['value']
-            wind_speed = current['windspeedKmph']
-            
-            return f"""🌍 Реальная погода в {city}:
+        text = f"""🌍 Реальная погода в {city}:
 🌡️ Температура: {temp}°C (ощущается как {feels_like}°C)
 ☁️ Условия: {weather_desc}
 💧 Влажность: {humidity}%
 💨 Ветер: {wind_speed} км/ч
 ✅ Данные получены с wttr.in API"""
+        
+        # Кэшируем только реальные данные, демо-ответ не сохраняем
+        with _WEATHER_CACHE_LOCK:
+            _WEATHER_CACHE.pop(key, None)
+            _WEATHER_CACHE[key] = (time.monotonic(), text)
+            while len(_WEATHER_CACHE) > _WEATHER_CACHE_MAX:
+                del _WEATHER_CACHE[next(iter(_WEATHER_CACHE))]
+        return text
     except Exception as e:
-        return f"""🌍 Демо погода для {city}:
-🌡️ Температура: {random.randint(15, 25)}°C
-☁️ Условия: Переменная облачность
-💧 Влажность: {random.randint(40, 70)}%
-⚠️ Примечание: Реальное API недоступно ({str(e)[:50]})"""
+        return _demo_weather(city, e)
 
 # ============================================
 # MCP TOOLS
@@ -723,151 +1130,287 @@ TOOLS = [
     }
 ]
 
-def handle_tool_call(name, args):
-    """Обработка вызова инструмента"""
-    args = args or {}
-    
-    if name == "get_weather":
-        city = args.get("city", "Moscow")
-        weather_info = get_real_weather(city)
-        return {"content": [{"type": "text", "text": weather_info}]}
-    
-    elif name == "add_task":
-        title = args.get("title", "")
-        description = args.get("description", "")
-        
-        if not title:
-            return {"content": [{"type": "text", "text": "❌ Ошибка: название задачи не может быть пустым"}], "isError": True}
-        
-        task_id = add_task(title, description)
-        return {"content": [{"type": "text", "text": f"✅ Задача #{task_id} добавлена: {title}"}]}
-    
-    elif name == "list_tasks":
-        status = args.get("status")
-        tasks = list_tasks(status)
-        
-        if not tasks:
-            msg = "📋 Нет задач"
-            if status == "pending":
-                msg = "✅ Нет активных задач"
-            elif status == "completed":
-                msg = "📋 Нет завершенных задач"
-            return {"content": [{"type": "text", "text": msg}]}
-        
-        text = f"📋 Список задач ({len(tasks)}):\n\n"
-        for task in tasks:
-            status_icon = "✅" if task['status'] == "completed" else "⏳"
-            text += f"{status_icon} #{task['id']}: {task['title']}\n"
-            if task['description']:
-                text += f"   {task['description']}\n"
-            text += f"   Создана: {task['created_at'][:10]}\n"
-            if task['completed_at']:
-                text += f"   Завершена: {task['completed_at'][:10]}\n"
-            text += "\n"
-        
-        return {"content": [{"type": "text", "text": text}]}
-    
-    elif name == "complete_task":
-        task_id = args.get("task_id")
-        
-        if not task_id:
-            return {"content": [{"type": "text", "text": "❌ Ошибка: укажите ID задачи"}], "isError": True}
-        
-        complete_task(task_id)
-        return {"content": [{"type": "text", "text": f"✅ Задача #{task_id} отмечена как выполненная"}]}
-    
-    elif name == "get_summary":
-        summary_data = get_today_summary()
-        summary_text = format_summary(summary_data)
-        return {"content": [{"type": "text", "text": summary_text}]}
+def _tool_get_weather(args):
+    """Погода в городе"""
+    city = args.get("city", "Moscow")
+    weather_info = get_real_weather(city)
+    return {"content": [{"type": "text", "text": weather_info}]}
+
+def _tool_add_task(args):
+    """Добавить задачу"""
+    title = args.get("title", "")
+    description = args.get("description", "")
     
-    elif name == "sync_todoist":
-        synced_count = sync_with_todoist()
-        
-        if synced_count > 0:
-            text = f"✅ Синхронизация завершена!\n\n📥 Синхронизировано задач с Todoist: {synced_count}\n\nИспользуйте /task list для просмотра всех задач."
-        elif TODOIST_API_TOKEN:
-            text = "ℹ️ Синхронизация завершена. Новых задач не найдено."
-        else:
-            text = "⚠️ Todoist не настроен.\n\nУстановите переменную окружения:\n- TODOIST_API_TOKEN\n\nПолучить токен: https://todoist.com/app/settings/integrations"
-        
-        return {"content": [{"type": "text", "text": text}]}
+    if not title:
+        return {"content": [{"type": "text", "text": "❌ Ошибка: название задачи не может быть пустым"}], "isError": True}
+    
+    task_id = add_task(title, description)
+    return {"content": [{"type": "text", "text": f"✅ Задача #{task_id} добавлена: {title}"}]}
+
+def _tool_list_tasks(args):
+    """Список задач"""
+    status = args.get("status")
+    tasks = list_tasks(status)
+    
+    if not tasks:
+        msg = "📋 Нет задач"
+        if status == "pending":
+            msg = "✅ Нет активных задач"
+        elif status == "completed":
+            msg = "📋 Нет завершенных задач"
+        return {"content": [{"type": "text", "text": msg}]}
+    
+    parts = [f"📋 Список задач ({len(tasks)}):\n\n"]
+    for task in tasks:
+        status_icon = "✅" if task['status'] == "completed" else "⏳"
+        parts.append(f"{status_icon} #{task['id']}: {task['title']}\n")
+        if task['description']:
+            parts.append(f"   {task['description']}\n")
+        parts.append(f"   Создана: {task['created_at'][:10]}\n")
+        if task['completed_at']:
+            parts.append(f"   Завершена: {task['completed_at'][:10]}\n")
+        parts.append("\n")
+    
+    return {"content": [{"type": "text", "text": "".join(parts)}]}
+
+def _tool_complete_task(args):
+    """Отметить задачу выполненной"""
+    task_id = args.get("task_id")
+    
+    if not task_id:
+        return {"content": [{"type": "text", "text": "❌ Ошибка: укажите ID задачи"}], "isError": True}
+    
+    complete_task(task_id)
+    return {"content": [{"type": "text", "text": f"✅ Задача #{task_id} отмечена как выполненная"}]}
+
+def _tool_get_summary(args):
+    """Сводка за сегодня"""
+    summary_data = get_today_summary()
+    summary_text = format_summary(summary_data)
+    return {"content": [{"type": "text", "text": summary_text}]}
+
+def _tool_sync_todoist(args):
+    """Синхронизация с Todoist"""
+    synced_count = sync_with_todoist()
     
-    elif name == "get_time":
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        return {"content": [{"type": "text", "text": f"🕐 Текущее время: {now}"}]}
+    if synced_count > 0:
+        text = f"✅ Синхронизация завершена!\n\n📥 Синхронизировано задач с Todoist: {synced_count}\n\nИспользуйте /task list для просмотра всех задач."
+    elif get_todoist_token():
+        text = "ℹ️ Синхронизация завершена. Новых задач не найдено."
+    else:
+        text = "⚠️ Todoist не настроен.\n\nУстановите переменную окружения:\n- TODOIST_API_TOKEN\n\nПолучить токен: https://todoist.com/app/settings/integrations"
     
-    return {"content": [{"type": "text", "text": f"❌ Неизвестный инструмент: {name}"}], "isError": True}
+    return {"content": [{"type": "text", "text": text}]}
+
+def _tool_get_time(args):
+    """Текущее время"""
+    now = datetime.now().isoformat(sep=" ", timespec="seconds")
+    return {"content": [{"type": "text", "text": f"🕐 Текущее время: {now}"}]}
+
+# Инструменты: имя -> обработчик(args)
+_TOOL_HANDLERS = {
+    "get_weather": _tool_get_weather,
+    "add_task": _tool_add_task,
+    "list_tasks": _tool_list_tasks,
+    "complete_task": _tool_complete_task,
+    "get_summary": _tool_get_summary,
+    "sync_todoist": _tool_sync_todoist,
+    "get_time": _tool_get_time,
+}
+
+def handle_tool_call(name, args):
+    """Обработка вызова инструмента"""
+    handler = _TOOL_HANDLERS.get(name)
+    if handler is None:
+        return {"content": [{"type": "text", "text": f"❌ Неизвестный инструмент: {name}"}], "isError": True}
+    return handler(args or {})
 
 # ============================================
 # HTTP SERVER
 # ============================================
 
+# Журнал запросов. По умолчанию пишутся только ошибки: print на каждый
+# запрос блокирует stdout. Подробный журнал: MCP_LOG_LEVEL=DEBUG
+log = logging.getLogger("mcp")
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+log.addHandler(_log_handler)
+log.setLevel(getattr(logging, os.getenv("MCP_LOG_LEVEL", "WARNING").upper(), logging.WARNING))
+log.propagate = False
+
+def json_dumps(obj):
+    """Сериализовать ответ в JSON-байты (через orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+def json_loads(data):
+    """Разобрать JSON из байтов или строки (через orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Результаты, которые не зависят от запроса, сериализуются один раз при
+# загрузке модуля. В ответ подставляется только id запроса
+_STATIC_RESULTS = {
+    "initialize": json_dumps({
+        "protocolVersion": "2024-11-05",
+        "capabilities": {
+            "tools": {"listChanged": False},
+            "resources": {"subscribe": False, "listChanged": False},
+            "prompts": {"listChanged": False}
+        },
+        "serverInfo": {
+            "name": "MCP Reminder Agent Server",
+            "version": "2.0.0"
+        }
+    }),
+    "notifications/initialized": json_dumps({}),
+    "tools/list": json_dumps({"tools": TOOLS}),
+    "resources/list": json_dumps({"resources": []}),
+    "prompts/list": json_dumps({"prompts": []}),
+}
+
+def _rpc_tools_call(params):
+    """tools/call: вызвать инструмент"""
+    name = params.get("name", "") if params else ""
+    args = params.get("arguments") if params else None
+    return handle_tool_call(name, args)
+
+# Методы, результат которых зависит от параметров: метод -> обработчик(params)
+_RPC_HANDLERS = {
+    "tools/call": _rpc_tools_call,
+}
+
+def _static_response(req_id, result_json):
+    """Собрать JSON-RPC ответ из готового сериализованного результата"""
+    return b'{"jsonrpc":"2.0","id":' + json_dumps(req_id) + b',"result":' + result_json + b'}'
+
 class MCPHandler(BaseHTTPRequestHandler):
+    # Буферы сокета по 64 КБ: заголовки и тело запроса читаются крупными
+    # блоками, а ответ уходит в сокет одним send при flush
+    rbufsize = 65536
+    wbufsize = 65536
+    
+    # Молчащий клиент освобождает поток пула не позже чем через 30 секунд
+    timeout = 30
+    
+    def setup(self):
+        # Маленькие JSON-ответы уходят сразу, без задержки алгоритма Нейгла
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 131072)
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 131072)
+        super().setup()
+    
+    # Заголовки ответа /mcp заранее собраны в байты: на запрос остается
+    # подставить длину тела и отправить все одним write
+    _JSON_OK_HEADER = (
+        f"{BaseHTTPRequestHandler.protocol_version} 200 OK\r\n"
+        "Content-Type: application/json\r\n"
+        "Access-Control-Allow-Origin: *\r\n"
+        "Content-Length: %d\r\n"
+        "\r\n"
+    ).encode('latin-1')
+    
     def do_POST(self):
-        # Обработка /set_interval
-        if self.path == "/set_interval":
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            
-            try:
-                data = json.loads(body)
-                interval_minutes = data.get("interval_minutes", 30)
-                
-                # Используем глобальную переменную sync_scheduler
-                global sync_scheduler
-                if sync_scheduler and sync_scheduler.set_interval(interval_minutes):
-                    response = {"status": "success", "interval_minutes": interval_minutes}
-                    self.send_response(200)
-                else:
-                    response = {"status": "error", "message": "Invalid interval"}
-                    self.send_response(400)
-                
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode('utf-8'))
-                return
-            except Exception as e:
-                self.send_error(500, str(e))
-                return
+        handler = self._POST_ROUTES.get(self.path)
+        if handler is None:
+            self.send_error(404)
+            return
+        
+        # Размер тела проверяем до чтения: слишком большой запрос отклоняем
+        # сразу и закрываем соединение, не принимая остаток
+        try:
+            self.content_length = int(self.headers.get('Content-Length', 0) or 0)
+        except ValueError:
+            self.content_length = -1
+        if self.content_length < 0:
+            self.close_connection = True
+            self.send_error(400, "Invalid Content-Length")
+            return
+        if self.content_length > MAX_BODY:
+            self.close_connection = True
+            self.send_error(413, "Payload too large")
+            return
+        
+        handler(self)
+    
+    def _read_body(self):
+        """Прочитать тело запроса в заранее выделенный буфер (без промежуточных копий)"""
+        content_length = self.content_length
+        body = bytearray(content_length)
+        view = memoryview(body)
+        received = 0
+        while received < content_length:
+            n = self.rfile.readinto(view[received:])
+            if not n:
+                break  # Клиент закрыл соединение раньше времени
+            received += n
+        view.release()
+        if received < content_length:
+            del body[received:]
+        return body
+    
+    def _handle_set_interval(self):
+        """Обработка /set_interval"""
+        body = self._read_body()
         
-        # Обработка /set_todoist_token
-        if self.path == "/set_todoist_token":
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
+        try:
+            data = json_loads(body)
+            interval_minutes = data.get("interval_minutes", 30)
             
-            try:
-                data = json.loads(body)
-                token = data.get("token", "")
-                
-                # Обновляем глобальную переменную TODOIST_API_TOKEN
-                global TODOIST_API_TOKEN
-                TODOIST_API_TOKEN = token
-                
-                print(f"✅ Todoist токен обновлён: {token[:10]}...")
-                
-                response = {"status": "success"}
+            # Используем глобальную переменную sync_scheduler
+            global sync_scheduler
+            if sync_scheduler and sync_scheduler.set_interval(interval_minutes):
+                response = {"status": "success", "interval_minutes": interval_minutes}
                 self.send_response(200)
-                
+            else:
+                response = {"status": "error", "message": "Invalid interval"}
+                self.send_response(400)
+            
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json_dumps(response))
+        except Exception as e:
+            self.send_error(500, str(e))
+    
+    def _handle_set_todoist_token(self):
+        """Обработка /set_todoist_token"""
+        body = self._read_body()
+        
+        try:
+            data = json_loads(body)
+            token = data.get("token", "")
+            
+            if not isinstance(token, str):
+                response = {"status": "error", "message": "Token must be a string"}
+                self.send_response(400)
                 self.send_header('Content-Type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps(response).encode('utf-8'))
-                return
-            except Exception as e:
-                self.send_error(500, str(e))
+                self.wfile.write(json_dumps(response))
                 return
-        
-        # Обработка /mcp
-        if self.path != "/mcp":
-            self.send_error(404)
-            return
-        
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length).decode('utf-8')
+            
+            # Сохраняем токен в файл, get_todoist_token подхватит его
+            set_todoist_token(token)
+            
+            print(f"✅ Todoist токен обновлён: {token[:10]}...")
+            
+            response = {"status": "success"}
+            self.send_response(200)
+            
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json_dumps(response))
+        except Exception as e:
+            self.send_error(500, str(e))
+    
+    def _handle_mcp(self):
+        """Обработка /mcp"""
+        body = self._read_body()
         
         try:
-            request = json.loads(body)
-        except json.JSONDecodeError:
+            request = json_loads(body)
+        except ValueError:  # JSONDecodeError или тело не в UTF-8
             self.send_error(400, "Invalid JSON")
             return
         
@@ -875,60 +1418,35 @@ class MCPHandler(BaseHTTPRequestHandler):
         params = request.get("params")
         req_id = request.get("id")
         
-        print(f"📨 {method}", params if params else "")
-        
-        result = None
-        error = None
-        
-        if method == "initialize":
-            result = {
-                "protocolVersion": "2024-11-05",
-                "capabilities": {
-                    "tools": {"listChanged": False},
-                    "resources": {"subscribe": False, "listChanged": False},
-                    "prompts": {"listChanged": False}
-                },
-                "serverInfo": {
-                    "name": "MCP Reminder Agent Server",
-                    "version": "2.0.0"
-                }
-            }
-        
-        elif method == "notifications/initialized":
-            result = {}
-        
-        elif method == "tools/list":
-            result = {"tools": TOOLS}
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("📨 %s %s", method, params if params else "")
         
-        elif method == "tools/call":
-            name = params.get("name", "") if params else ""
-            args = params.get("arguments") if params else None
-            result = handle_tool_call(name, args)
-        
-        elif method == "resources/list":
-            result = {"resources": []}
-        
-        elif method == "prompts/list":
-            result = {"prompts": []}
-        
-        else:
-            error = {"code": -32601, "message": f"Method not found: {method}"}
-        
-        response = {"jsonrpc": "2.0", "id": req_id}
-        if error:
-            response["error"] = error
-            print(f"❌ Error: {error['message']}")
+        # Не строковый method (список, объект) не должен ронять поиск по словарю
+        static_result = _STATIC_RESULTS.get(method) if isinstance(method, str) else None
+        if static_result is not None:
+            response_body = _static_response(req_id, static_result)
+            log.debug("✅ OK")
         else:
-            response["result"] = result
-            print(f"✅ OK")
+            result = None
+            error = None
+            
+            handler = _RPC_HANDLERS.get(method) if isinstance(method, str) else None
+            if handler is None:
+                error = {"code": -32601, "message": f"Method not found: {method}"}
+            else:
+                result = handler(params)
+            
+            response = {"jsonrpc": "2.0", "id": req_id}
+            if error:
+                response["error"] = error
+                log.error("❌ Error: %s", error['message'])
+            else:
+                response["result"] = result
+                log.debug("✅ OK")
+            
+            response_body = json_dumps(response)
         
-        response_body = json.dumps(response).encode('utf-8')
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Length', len(response_body))
-        self.end_headers()
-        self.wfile.write(response_body)
+        self.wfile.write(self._JSON_OK_HEADER % len(response_body) + response_body)
     
     def do_OPTIONS(self):
         self.send_response(200)
@@ -939,6 +1457,48 @@ class MCPHandler(BaseHTTPRequestHandler):
     
     def log_message(self, format, *args):
         pass
+    
+    # Маршруты POST: путь -> обработчик
+    _POST_ROUTES = {
+        "/set_interval": _handle_set_interval,
+        "/set_todoist_token": _handle_set_todoist_token,
+        "/mcp": _handle_mcp,
+    }
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер с фиксированным пулом потоков-обработчиков.
+    
+    Потоки переиспользуются между запросами, поэтому их соединения с БД
+    (_conn) не открываются заново на каждый запрос, а состояние процесса
+    (токен, планировщики, кэш погоды) остается общим
+    """
+    
+    pool_size = HTTP_WORKERS  # Обработчики в основном ждут сеть и БД, а не CPU
+    request_queue_size = 128  # Очередь listen: всплеск подключений не теряет SYN
+    
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        # Потоки-демоны не держат процесс при выходе, даже если клиент
+        # еще не закрыл соединение
+        self._requests = queue.SimpleQueue()
+        for i in range(self.pool_size):
+            threading.Thread(target=self._worker, name=f"http-{i}", daemon=True).start()
+    
+    def _worker(self):
+        """Поток пула: обрабатывает соединения из очереди до сигнала остановки"""
+        while True:
+            request, client_address = self._requests.get()
+            if request is None:
+                return
+            self.process_request_thread(request, client_address)
+    
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+    
+    def server_close(self):
+        super().server_close()
+        for _ in range(self.pool_size):
+            self._requests.put((None, None))
 
 def get_local_ip():
     """Получить локальный IP"""
@@ -973,20 +1533,27 @@ if __name__ == "__main__":
     sync_scheduler = PeriodicSyncScheduler(interval_minutes=30)
     sync_scheduler.start()
     
-    print()
-    print("🚀 MCP Reminder Agent Server запущен!")
-    print()
-    print("📱 Для подключения с Android используйте:")
-    print(f"   http://{IP}:{PORT}/mcp")
-    print()
-    print("🔧 Доступные инструменты:")
-    for t in TOOLS:
-        print(f"   - {t['name']}: {t['description']}")
-    print()
-    print("Нажмите Ctrl+C для остановки")
-    print()
-    
-    server = HTTPServer(("0.0.0.0", PORT), MCPHandler)
+    # Баннер собирается целиком и выводится одной записью
+    tools_text = "\n".join(f"   - {t['name']}: {t['description']}" for t in TOOLS)
+    banner = (
+        "\n"
+        "🚀 MCP Reminder Agent Server запущен!\n"
+        "\n"
+        "📱 Для подключения с Android используйте:\n"
+        f"   http://{IP}:{PORT}/mcp\n"
+        "\n"
+        "🔧 Доступные инструменты:\n"
+        f"{tools_text}\n"
+        "\n"
+        "Нажмите Ctrl+C для остановки\n"
+        "\n"
+    )
+    sys.stdout.write(banner)
+    sys.stdout.flush()
+    
+    # Запросы обрабатываются пулом потоков: долгий запрос погоды
+    # не блокирует остальных клиентов
+    server = PooledHTTPServer(("0.0.0.0", PORT), MCPHandler)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -994,4 +1561,5 @@ if __name__ == "__main__":
         daily_scheduler.stop()
         sync_scheduler.stop()
         server.shutdown()
+        server.server_close()
         print("✅ Сервер остановлен")